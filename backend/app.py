@@ -1,21 +1,46 @@
-from flask import Flask, request, jsonify, send_file, Response
+"""Flask API for invoice upload, extraction and reconciliation.
+
+Development:  python app.py
+Production:   gunicorn -w 4 -k gthread --threads 8 --timeout 1800 -b 0.0.0.0:5000 'app:create_app()'
+
+/upload-invoices waits for extraction and reconciliation to finish, and each
+/progress stream holds a connection open, so use threaded (gthread) or gevent
+workers and a --timeout longer than the slowest extraction batch. The default
+sync workers would be killed after 30 seconds mid-extraction.
+
+Configuration is read from the environment (see ``create_app``) so every
+worker process builds an identical app without sharing module state.
+"""
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Blueprint, Flask, current_app, request, jsonify, send_file, Response
 from flask_cors import CORS
 import os
 from werkzeug.utils import secure_filename
-import subprocess
-import pandas as pd
-import glob
 import json
-import time
 import sys
-import psutil
 import logging
-import threading
 import shutil
+import uuid
+from datetime import datetime, timedelta
+import invoice_registry
+import export_results
+import preflight
+from upload_manifest import UploadManifest, REJECTED
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+# pandas and subprocess are imported inside the routes that need them so
+# workers start quickly and cheap endpoints never pay for them.
 
 # Configure logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv('INVOICING_LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(sys.stdout)
@@ -23,73 +48,190 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
-
-# Enable debug mode
-app.debug = True
-
-# Configure Flask logging
-app.logger.setLevel(logging.DEBUG)
-
 # Disable werkzeug logging
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
-UPLOAD_FOLDER = 'invoice_temp_storage'
-STATEMENT_FOLDER = '.'
-ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'csv'}
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Settings that are paths, and the ones handed on to the extraction and
+# reconciliation scripts as INVOICING_<KEY> environment variables
+PATH_SETTINGS = (
+    'UPLOAD_FOLDER', 'STATEMENT_FOLDER', 'RESULTS_FOLDER', 'EXTRACTED_FOLDER',
+    'PROGRESS_FILE', 'REGISTRY_DB', 'MANIFEST_DB', 'QUARANTINE_FOLDER',
+)
+
+INVOICE_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
+STATEMENT_EXTENSIONS = {'csv'}
+
+bp = Blueprint('invoicing', __name__)
+
+def _env_flag(name, default='false'):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
 
-# Global variable to store progress
-current_progress = {"processed": 0, "total": 0}
+def _max_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux), or None if unknown."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def create_app(config=None):
+    """Build the Flask app. Every setting can be overridden through the environment."""
+    app = Flask(__name__)
+    app.config.from_mapping(
+        DEBUG=_env_flag('INVOICING_DEBUG'),
+        UPLOAD_FOLDER=os.getenv('INVOICING_UPLOAD_FOLDER', 'invoice_temp_storage'),
+        STATEMENT_FOLDER=os.getenv('INVOICING_STATEMENT_FOLDER', '.'),
+        RESULTS_FOLDER=os.getenv('INVOICING_RESULTS_FOLDER', 'reconcilliation_results'),
+        EXTRACTED_FOLDER=os.getenv('INVOICING_EXTRACTED_FOLDER', 'extracted_invoices'),
+        PROGRESS_FILE=os.getenv('INVOICING_PROGRESS_FILE', 'extraction_progress.json'),
+        REGISTRY_DB=os.getenv('INVOICING_REGISTRY_DB', invoice_registry.DEFAULT_DB),
+        MANIFEST_DB=os.getenv('INVOICING_MANIFEST_DB', 'upload_manifest.db'),
+        QUARANTINE_FOLDER=os.getenv('INVOICING_QUARANTINE_FOLDER', 'invoice_quarantine'),
+        CORS_ORIGINS=os.getenv('INVOICING_CORS_ORIGINS', '*'),
+        PROGRESS_IDLE_SECONDS=float(os.getenv('INVOICING_PROGRESS_IDLE_SECONDS', '10')),
+    )
+    if config:
+        app.config.update(config)
 
-@app.before_request
+    # Relative paths are relative to this directory, where the scripts also run,
+    # so every route and script sees the same files whatever the working directory
+    for key in PATH_SETTINGS:
+        app.config[key] = os.path.join(BASE_DIR, app.config[key])
+
+    CORS(app, origins=app.config['CORS_ORIGINS'])
+
+    # Create necessary directories if they don't exist
+    for key in ('UPLOAD_FOLDER', 'RESULTS_FOLDER', 'EXTRACTED_FOLDER', 'QUARANTINE_FOLDER'):
+        os.makedirs(app.config[key], exist_ok=True)
+
+    app.extensions['upload_manifest'] = UploadManifest(app.config['MANIFEST_DB'], app.config['QUARANTINE_FOLDER'])
+    # Files uploaded before the manifest existed, or copied in by hand, are listed too
+    app.extensions['upload_manifest'].sync(app.config['UPLOAD_FOLDER'], INVOICE_EXTENSIONS)
+
+    app.register_blueprint(bp)
+
+    app.config['STARTUP_MS'] = (time.perf_counter() - _IMPORT_STARTED) * 1000
+    max_rss = _max_rss_mb()
+    logger.info(
+        "Worker %d ready in %.1f ms (peak RSS %s)",
+        os.getpid(), app.config['STARTUP_MS'], f"{max_rss:.1f} MB" if max_rss is not None else "unknown"
+    )
+    return app
+
+def allowed_file(filename, extensions):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+def upload_manifest():
+    return current_app.extensions['upload_manifest']
+
+def run_script(script):
+    """Run one of the backend scripts with this app's folder and database settings."""
+    import subprocess
+
+    env = dict(os.environ)
+    env.update({f'INVOICING_{key}': current_app.config[key] for key in PATH_SETTINGS})
+    return subprocess.run([sys.executable, os.path.join(BASE_DIR, script)], check=True, cwd=BASE_DIR, env=env)
+
+def get_next_filename(base_name):
+    """Generate next available filename with incrementing number."""
+    counter = 1
+    filename = base_name
+    while os.path.exists(filename):
+        name, ext = os.path.splitext(base_name)
+        filename = f"{name}_{counter}{ext}"
+        counter += 1
+    return filename
+
+def read_progress(progress_file):
+    """Read extraction progress from the shared progress file.
+
+    Progress lives on disk rather than in a module global so that every
+    worker process reports the same state.
+    """
+    try:
+        with open(progress_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"processed": 0, "total": 0}
+
+@bp.before_request
 def log_request_info():
-    logger.debug('Headers: %s', request.headers)
-    logger.debug('Body: %s', request.get_data())
+    # Reading the body buffers the whole upload, so only do it in debug mode
+    if current_app.debug:
+        logger.debug('Headers: %s', request.headers)
+        logger.debug('Body: %s', request.get_data())
 
-@app.route('/progress', methods=['GET'])
+@bp.route('/ready', methods=['GET'])
+def readiness():
+    folders = {
+        key: current_app.config[key]
+        for key in ('UPLOAD_FOLDER', 'STATEMENT_FOLDER', 'RESULTS_FOLDER', 'EXTRACTED_FOLDER', 'QUARANTINE_FOLDER')
+    }
+    unavailable = [
+        key for key, path in folders.items()
+        if not (os.path.isdir(path) and os.access(path, os.W_OK))
+    ]
+    max_rss = _max_rss_mb()
+    status = {
+        'status': 'unavailable' if unavailable else 'ready',
+        'pid': os.getpid(),
+        'startup_ms': round(current_app.config['STARTUP_MS'], 1),
+        'max_rss_mb': round(max_rss, 1) if max_rss is not None else None,
+    }
+    if unavailable:
+        status['unavailable'] = unavailable
+        return jsonify(status), 503
+    return jsonify(status)
+
+@bp.route('/progress', methods=['GET'])
 def get_progress():
+    progress_file = current_app.config['PROGRESS_FILE']
+    idle_deadline = time.monotonic() + current_app.config['PROGRESS_IDLE_SECONDS']
+
     def generate():
         while True:
+            current_progress = read_progress(progress_file)
             # Send the current progress
             yield f"data: {json.dumps(current_progress)}\n\n"
             # If processing is complete, send a final message and break
             if current_progress["processed"] >= current_progress["total"] and current_progress["total"] > 0:
                 yield f"data: {json.dumps({'complete': True})}\n\n"
                 break
+            # Don't hold a worker thread open when no extraction has started
+            if current_progress["total"] == 0 and time.monotonic() > idle_deadline:
+                yield f"data: {json.dumps({'complete': True, 'idle': True})}\n\n"
+                break
             time.sleep(0.5)  # Update every 0.5 seconds
 
     return Response(generate(), mimetype='text/event-stream')
 
-@app.route('/uploaded-invoices', methods=['GET'])
+@bp.route('/uploaded-invoices', methods=['GET'])
 def get_uploaded_invoices():
     try:
-        # Get all files in the invoice storage folder
-        files = []
-        for ext in ALLOWED_EXTENSIONS:
-            files.extend(glob.glob(os.path.join(UPLOAD_FOLDER, f'*.{ext}')))
-        
-        # Get file info
+        # One read of the manifest instead of globbing and stat-ing every file
         file_info = []
-        for file_path in files:
+        for entry in upload_manifest().entries():
             file_info.append({
-                'name': os.path.basename(file_path),
-                'size': os.path.getsize(file_path),
-                'uploaded_at': os.path.getctime(file_path)
+                'name': entry['filename'],
+                'size': entry['size'],
+                'uploaded_at': entry['uploaded_at'],
+                'content_hash': entry['content_hash'],
+                'status': entry['status'],
+                'invoice_id': entry['invoice_id'],
+                'last_error': entry['last_error'],
+                'metadata': entry['metadata']
             })
         
         return jsonify(file_info)
     except Exception as e:
         return jsonify({'error': f'Failed to get uploaded invoices: {str(e)}'}), 500
 
-@app.route('/uploaded-statement', methods=['GET'])
+@bp.route('/uploaded-statement', methods=['GET'])
 def get_uploaded_statement():
     try:
-        statement_path = os.path.join(STATEMENT_FOLDER, 'supplier_statement.csv')
+        statement_path = os.path.join(current_app.config['STATEMENT_FOLDER'], 'supplier_statement.csv')
         if os.path.exists(statement_path):
             return jsonify({
                 'name': 'supplier_statement.csv',
@@ -100,7 +242,7 @@ def get_uploaded_statement():
     except Exception as e:
         return jsonify({'error': f'Failed to get uploaded statement: {str(e)}'}), 500
 
-@app.route('/upload-invoices', methods=['POST'])
+@bp.route('/upload-invoices', methods=['POST'])
 def upload_invoices():
     print("Received upload request")
     sys.stdout.flush()
@@ -125,7 +267,7 @@ def upload_invoices():
     
     try:
         # Ensure the upload directory exists
-        upload_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), UPLOAD_FOLDER))
+        upload_dir = current_app.config['UPLOAD_FOLDER']
         os.makedirs(upload_dir, exist_ok=True)
         
         # Check if we're in append mode
@@ -145,17 +287,55 @@ def upload_invoices():
                 except Exception as e:
                     print(f"Error deleting {file_path}: {e}")
                     sys.stdout.flush()
+            upload_manifest().clear()
         
         # Save new files
-        saved_files = []
+        saved_paths = {}
+        rejected = []
         for file in files:
             if file and file.filename:
                 filename = secure_filename(file.filename)
+                if not allowed_file(filename, INVOICE_EXTENSIONS):
+                    rejected.append({'file': filename, 'reason': 'Unsupported file type'})
+                    continue
                 filepath = os.path.join(upload_dir, filename)
                 file.save(filepath)
-                saved_files.append(filename)
+                saved_paths[filename] = filepath
                 print(f"Saved file: {filepath}")
                 sys.stdout.flush()
+
+        # Pre-flight checks run in parallel so bad files fail now, not mid-batch.
+        # Rejected files are quarantined; the rest are queued for extraction
+        # and flagged if they were already extracted in an earlier batch.
+        checks = preflight.check_files(list(saved_paths.values()))
+        quarantine_dir = current_app.config['QUARANTINE_FOLDER']
+        os.makedirs(quarantine_dir, exist_ok=True)
+        saved_files = []
+        duplicates = []
+        registry = invoice_registry.connect(current_app.config['REGISTRY_DB'])
+        try:
+            for (filename, filepath), check in zip(saved_paths.items(), checks):
+                metadata = {key: check[key] for key in ('kind', 'pages', 'encrypted', 'has_text', 'width', 'height')}
+                if not check['ok']:
+                    print(f"Rejected {filename}: {check['reason']}")
+                    sys.stdout.flush()
+                    # Rejected files with the same name must not overwrite each other
+                    metadata['quarantined_as'] = f"{uuid.uuid4().hex[:12]}_{filename}"
+                    os.replace(filepath, os.path.join(quarantine_dir, metadata['quarantined_as']))
+                    upload_manifest().record_upload(
+                        filename, check['size'], check['content_hash'],
+                        metadata=metadata, status=REJECTED, error=check['reason']
+                    )
+                    rejected.append({'file': filename, 'reason': check['reason']})
+                    continue
+
+                saved_files.append(filename)
+                upload_manifest().record_upload(filename, check['size'], check['content_hash'], metadata=metadata)
+                previous = invoice_registry.find_by_hash(registry, check['content_hash'])
+                if previous:
+                    duplicates.append({'file': filename, **dict(previous)})
+        finally:
+            registry.close()
         
         if not saved_files:
             print("No files were saved")
@@ -163,7 +343,8 @@ def upload_invoices():
             return jsonify({
                 'success': True,
                 'message': 'No files were saved',
-                'files': []
+                'files': [],
+                'rejected': rejected
             })
 
         # Process all files in the folder
@@ -171,7 +352,7 @@ def upload_invoices():
         sys.stdout.flush()
         
         # Run extract_invoices.py on the entire folder
-        extract_result = subprocess.run(['python', 'extract_invoices.py'], check=True)
+        extract_result = run_script('extract_invoices.py')
         if extract_result.returncode != 0:
             raise Exception("Invoice extraction failed")
             
@@ -179,14 +360,25 @@ def upload_invoices():
         sys.stdout.flush()
         
         # Run reconcile_data.py
-        reconcile_result = subprocess.run(['python', 'reconcile_data.py'], check=True)
+        reconcile_result = run_script('reconcile_data.py')
         if reconcile_result.returncode != 0:
             raise Exception("Reconciliation failed")
+
+        # Invoices with the same Invoice ID and supplier as one from an earlier
+        # batch, as found by the extractor (duplicates only catches identical files)
+        duplicate_invoices = []
+        for filename in saved_files:
+            entry = upload_manifest().get(filename)
+            for previous in ((entry or {}).get('metadata') or {}).get('possible_duplicates', []):
+                duplicate_invoices.append({'file': filename, **previous})
         
         return jsonify({
             'success': True,
             'message': 'Files uploaded and processed successfully',
-            'files': saved_files
+            'files': saved_files,
+            'rejected': rejected,
+            'duplicates': duplicates,
+            'duplicate_invoices': duplicate_invoices
         })
         
     except Exception as e:
@@ -194,7 +386,7 @@ def upload_invoices():
         sys.stdout.flush()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/upload-statement', methods=['POST'])
+@bp.route('/upload-statement', methods=['POST'])
 def upload_statement():
     if 'statement' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -204,31 +396,50 @@ def upload_statement():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    if file and allowed_file(file.filename):
+    if file and allowed_file(file.filename, STATEMENT_EXTENSIONS):
         filename = secure_filename(file.filename)
-        file.save(os.path.join(STATEMENT_FOLDER, 'supplier_statement.csv'))
+        file.save(os.path.join(current_app.config['STATEMENT_FOLDER'], 'supplier_statement.csv'))
         
         # Run the reconciliation script
+        import subprocess
         try:
-            subprocess.run(['python', 'reconcile_data.py'], check=True)
+            run_script('reconcile_data.py')
             return jsonify({'success': True})
         except subprocess.CalledProcessError as e:
             return jsonify({'error': f'Failed to process statement: {str(e)}'}), 500
 
     return jsonify({'error': 'Invalid file type'}), 400
 
-@app.route('/reconciliation-results', methods=['GET'])
+@bp.route('/reconciliation-runs', methods=['GET'])
+def get_reconciliation_runs():
+    try:
+        # Optional start/end dates (YYYY-MM-DD) filter runs by when they were created
+        start = request.args.get('start')
+        end = request.args.get('end')
+        runs = export_results.list_runs(
+            current_app.config['RESULTS_FOLDER'],
+            start=datetime.fromisoformat(start).timestamp() if start else None,
+            end=(datetime.fromisoformat(end) + timedelta(days=1)).timestamp() if end else None
+        )
+        return jsonify(runs)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Failed to list reconciliation runs: {str(e)}'}), 500
+
+@bp.route('/reconciliation-results', methods=['GET'])
 def get_reconciliation_results():
     try:
-        # Find the most recent reconciliation results file
-        results_files = [f for f in os.listdir('reconcilliation_results') if f.startswith('reconciliation_results')]
-        if not results_files:
-            return jsonify({'error': 'No reconciliation results found'}), 404
-        
-        latest_file = max(results_files, key=lambda x: os.path.getctime(os.path.join('reconcilliation_results', x)))
+        # Find the requested run, or the most recent one
+        try:
+            results_path = export_results.run_path(current_app.config['RESULTS_FOLDER'], request.args.get('run'))
+        except FileNotFoundError as e:
+            return jsonify({'error': str(e)}), 404
         
+        import pandas as pd
+
         # Read the CSV file
-        df = pd.read_csv(os.path.join('reconcilliation_results', latest_file))
+        df = pd.read_csv(results_path)
         
         # Convert DataFrame to list of dictionaries
         results = df.to_dict('records')
@@ -237,32 +448,57 @@ def get_reconciliation_results():
     except Exception as e:
         return jsonify({'error': f'Failed to fetch results: {str(e)}'}), 500
 
-@app.route('/export-reconciliation', methods=['GET'])
+@bp.route('/export-reconciliation', methods=['GET'])
 def export_reconciliation():
     try:
-        # Find the most recent reconciliation results file
-        results_files = [f for f in os.listdir('reconcilliation_results') if f.startswith('reconciliation_results')]
-        if not results_files:
-            return jsonify({'error': 'No reconciliation results found'}), 404
-        
-        latest_file = max(results_files, key=lambda x: os.path.getctime(os.path.join('reconcilliation_results', x)))
-        file_path = os.path.join('reconcilliation_results', latest_file)
+        # Statuses can be repeated (?status=Missing&status=Extra) or comma separated
+        statuses = [s.strip() for value in request.args.getlist('status') for s in value.split(',') if s.strip()]
+        try:
+            file_path, mimetype, download_name = export_results.export_run(
+                current_app.config['RESULTS_FOLDER'],
+                run=request.args.get('run'),
+                fmt=request.args.get('format', 'csv').lower(),
+                statuses=statuses
+            )
+        except FileNotFoundError as e:
+            return jsonify({'error': str(e)}), 404
+        except export_results.ExportError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Send the file
+        # Send the file; conditional responses support Range requests for resumed downloads
         return send_file(
             file_path,
-            mimetype='text/csv',
+            mimetype=mimetype,
             as_attachment=True,
-            download_name=latest_file
+            download_name=download_name,
+            conditional=True
         )
     except Exception as e:
         return jsonify({'error': f'Failed to export results: {str(e)}'}), 500
 
-@app.route('/uploaded-invoices/<filename>', methods=['DELETE'])
+@bp.route('/uploaded-invoices/<filename>', methods=['DELETE'])
 def delete_uploaded_invoice(filename):
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if os.path.exists(file_path):
+        filename = secure_filename(filename)
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        entry = upload_manifest().get(filename)
+        # The entry (with its extraction row) and the file are removed together
+        if upload_manifest().remove(filename, file_path):
+            if entry['extracted_row'] is not None:
+                # Rewrite the extracted invoices without this one and reconcile
+                # again, so the results don't keep showing a deleted invoice
+                import subprocess
+
+                extracted_file = get_next_filename(
+                    os.path.join(current_app.config['EXTRACTED_FOLDER'], 'extracted_invoices.csv')
+                )
+                upload_manifest().write_extracted_csv(extracted_file)
+                try:
+                    run_script('reconcile_data.py')
+                except subprocess.CalledProcessError as e:
+                    return jsonify({'success': True, 'warning': f'Reconciliation results were not refreshed: {str(e)}'})
+            return jsonify({'success': True})
+        elif os.path.exists(file_path):
             os.remove(file_path)
             return jsonify({'success': True})
         else:
@@ -270,13 +506,38 @@ def delete_uploaded_invoice(filename):
     except Exception as e:
         return jsonify({'error': f'Failed to delete file: {str(e)}'}), 500
 
-@app.route('/statement-preview', methods=['GET'])
+@bp.route('/invoice-registry', methods=['GET'])
+def get_invoice_registry():
+    try:
+        registry = invoice_registry.connect(current_app.config['REGISTRY_DB'])
+        try:
+            if request.args.get('invoice_id'):
+                rows = invoice_registry.find_duplicates(
+                    registry, request.args['invoice_id'], request.args.get('supplier')
+                )
+            else:
+                rows = invoice_registry.history(
+                    registry,
+                    start_date=request.args.get('start'),
+                    end_date=request.args.get('end'),
+                    supplier=request.args.get('supplier'),
+                    limit=request.args.get('limit', 1000, type=int)
+                )
+        finally:
+            registry.close()
+        return jsonify([dict(row) for row in rows])
+    except Exception as e:
+        return jsonify({'error': f'Failed to query invoice registry: {str(e)}'}), 500
+
+@bp.route('/statement-preview', methods=['GET'])
 def get_statement_preview():
     try:
-        statement_path = os.path.join(STATEMENT_FOLDER, 'supplier_statement.csv')
+        statement_path = os.path.join(current_app.config['STATEMENT_FOLDER'], 'supplier_statement.csv')
         if not os.path.exists(statement_path):
             return jsonify({'error': 'No statement file found'}), 404
         
+        import pandas as pd
+
         # Read the entire CSV file
         df = pd.read_csv(statement_path)
         
@@ -297,9 +558,7 @@ def get_statement_preview():
         return jsonify({'error': f'Failed to read statement preview: {str(e)}'}), 500
 
 if __name__ == '__main__':
-    # Create necessary directories if they don't exist
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    os.makedirs('reconcilliation_results', exist_ok=True)
-    
+    # Development server only; use a WSGI server such as gunicorn in production
+    app = create_app()
     logger.info("Starting Flask application...")
-    app.run(debug=True, port=5000) 
\ No newline at end of file
+    app.run(debug=app.config['DEBUG'], port=int(os.getenv('PORT', '5000')))
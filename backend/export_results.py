@@ -0,0 +1,198 @@
+"""Export reconciliation runs as CSV, XLSX, Parquet or JSONL.
+
+A run is one reconciliation_results*.csv file, identified by its name without
+the extension. Exports are generated a chunk at a time into a per-run cache,
+so a large run never has to fit in memory and repeat downloads (including
+HTTP range requests for resumed downloads) are served straight from disk.
+"""
+import os
+import hashlib
+import tempfile
+
+LATEST_POINTER = "latest_run.txt"
+EXPORT_FOLDER = "exports"
+CHUNK_ROWS = 50_000
+STATUSES = ('Missing', 'Extra', 'Discrepancy', 'Matched', 'Totals')
+
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'jsonl': ('application/x-ndjson', '.jsonl'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+class ExportError(Exception):
+    """Raised when an export can't be produced from the request as given."""
+
+def mark_latest(results_file):
+    """Record results_file as the latest run so readers don't have to scan the folder."""
+    results_folder = os.path.dirname(results_file) or "."
+    pointer = os.path.join(results_folder, LATEST_POINTER)
+    tmp_pointer = f"{pointer}.{os.getpid()}.tmp"
+    with open(tmp_pointer, "w") as f:
+        f.write(os.path.basename(results_file))
+    os.replace(tmp_pointer, pointer)
+
+def list_runs(results_folder, start=None, end=None):
+    """List runs, newest first, optionally limited to runs created between two timestamps."""
+    runs = []
+    with os.scandir(results_folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.startswith('reconciliation_results') and entry.name.endswith('.csv'):
+                stat = entry.stat()
+                if (start is None or stat.st_ctime >= start) and (end is None or stat.st_ctime <= end):
+                    runs.append({'run': entry.name[:-len('.csv')], 'size': stat.st_size, 'created_at': stat.st_ctime})
+    return sorted(runs, key=lambda run: run['created_at'], reverse=True)
+
+def latest_run(results_folder):
+    """Return the latest run's file name, or None if there are no runs."""
+    try:
+        with open(os.path.join(results_folder, LATEST_POINTER)) as f:
+            name = f.read().strip()
+        if name and os.path.exists(os.path.join(results_folder, name)):
+            return name
+    except OSError:
+        pass
+    # Runs written before the pointer existed
+    runs = list_runs(results_folder)
+    return f"{runs[0]['run']}.csv" if runs else None
+
+def run_path(results_folder, run=None):
+    """Resolve a run name (or the latest run) to its results file."""
+    if run is None:
+        name = latest_run(results_folder)
+        if name is None:
+            raise FileNotFoundError('No reconciliation results found')
+    else:
+        name = f"{os.path.basename(run)}.csv"
+    path = os.path.join(results_folder, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'Reconciliation run {run} not found')
+    return path
+
+def _read_chunks(source, statuses):
+    import pandas as pd
+
+    # Read everything as text so values are exported exactly as written
+    for chunk in pd.read_csv(source, chunksize=CHUNK_ROWS, dtype=str, keep_default_na=False):
+        if statuses:
+            chunk = chunk[chunk['Status'].isin(statuses)]
+        yield chunk
+
+def _write_csv(source, target, statuses):
+    with open(target, 'w', encoding='utf-8-sig', newline='') as out:
+        header = True
+        for chunk in _read_chunks(source, statuses):
+            chunk.to_csv(out, header=header, index=False)
+            header = False
+
+def _write_jsonl(source, target, statuses):
+    with open(target, 'w', encoding='utf-8') as out:
+        for chunk in _read_chunks(source, statuses):
+            if len(chunk):
+                out.write(chunk.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+
+def _write_xlsx(source, target, statuses):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ExportError("XLSX export needs 'openpyxl'. Install it with: pip install openpyxl")
+
+    # Write-only workbooks stream rows to disk instead of holding them in memory
+    workbook = Workbook(write_only=True)
+    sheets = {}
+    for chunk in _read_chunks(source, statuses):
+        for row in chunk.itertuples(index=False):
+            status = row.Status or 'Unknown'
+            if status not in sheets:
+                # Sheet titles are limited to 31 characters
+                sheets[status] = workbook.create_sheet(title=status[:31])
+                sheets[status].append(list(chunk.columns))
+            sheets[status].append(list(row))
+    if not sheets:
+        workbook.create_sheet(title='Results')
+    workbook.save(target)
+
+def _write_parquet(source, target, statuses):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export needs 'pyarrow'. Install it with: pip install pyarrow")
+
+    writer = None
+    try:
+        for chunk in _read_chunks(source, statuses):
+            if writer is None:
+                # Every column is read as text, so fix the schema rather than infer it per chunk
+                schema = pa.schema([(column, pa.string()) for column in chunk.columns])
+                writer = pq.ParquetWriter(target, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ExportError('Reconciliation run is empty')
+
+WRITERS = {
+    'csv': _write_csv,
+    'jsonl': _write_jsonl,
+    'xlsx': _write_xlsx,
+    'parquet': _write_parquet,
+}
+
+def export_run(results_folder, run=None, fmt='csv', statuses=None):
+    """Return (path, mimetype, download_name) for a run exported in the given format.
+
+    The export is cached under results_folder/exports and regenerated only when
+    the run's results file changes, at which point the run's older exports are
+    removed.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unsupported format '{fmt}'. Choose one of: {', '.join(FORMATS)}")
+    statuses = sorted(set(statuses or []))
+    unknown = [status for status in statuses if status not in STATUSES]
+    if unknown:
+        raise ExportError(f"Unknown status {', '.join(unknown)}. Choose from: {', '.join(STATUSES)}")
+    mimetype, ext = FORMATS[fmt]
+    source = run_path(results_folder, run)
+    run_name = os.path.splitext(os.path.basename(source))[0]
+
+    # The unfiltered CSV is the results file itself
+    if fmt == 'csv' and not statuses:
+        return source, mimetype, f"{run_name}{ext}"
+
+    # Cached files are named <format>-<version of the results file>-<statuses>
+    stat = os.stat(source)
+    source_key = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:12]
+    status_key = hashlib.sha1(','.join(statuses).encode()).hexdigest()[:8]
+    cache_dir = os.path.join(results_folder, EXPORT_FOLDER, run_name)
+    target = os.path.join(cache_dir, f"{fmt}-{source_key}-{status_key}{ext}")
+    download_name = f"{run_name}{'_' + '_'.join(statuses) if statuses else ''}{ext}"
+    if os.path.exists(target):
+        return target, mimetype, download_name
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Build in a temporary file so concurrent requests never serve a partial export
+    fd, tmp_target = tempfile.mkstemp(dir=cache_dir, suffix=ext)
+    os.close(fd)
+    try:
+        WRITERS[fmt](source, tmp_target, statuses)
+        os.replace(tmp_target, target)
+    except BaseException:
+        os.remove(tmp_target)
+        raise
+    _prune_exports(cache_dir, source_key)
+    return target, mimetype, download_name
+
+def _prune_exports(cache_dir, source_key):
+    """Remove a run's exports built from an earlier version of its results file."""
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            parts = entry.name.split('-')
+            # Temporary files from in-progress exports have no format prefix
+            if len(parts) == 3 and parts[0] in FORMATS and parts[1] != source_key:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass # Still being downloaded (Windows), so leave it for next time
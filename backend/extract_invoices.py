@@ -3,7 +3,11 @@ from dotenv import load_dotenv
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 import pandas as pd
-import glob # To find files in a folder
+import json
+import hashlib
+import invoice_registry
+import preflight
+from upload_manifest import UploadManifest
 
 def get_next_filename(base_name):
     """Generate next available filename with incrementing number."""
@@ -15,6 +19,14 @@ def get_next_filename(base_name):
         counter += 1
     return filename
 
+def write_progress(processed, total):
+    """Write progress to the file polled by the API's /progress endpoint."""
+    progress_file = os.getenv("INVOICING_PROGRESS_FILE", "extraction_progress.json")
+    tmp_file = f"{progress_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"processed": processed, "total": total}, f)
+    os.replace(tmp_file, progress_file) # Atomic, so readers never see a partial file
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -29,30 +41,55 @@ if not endpoint or not key:
 # Create a DocumentAnalysisClient
 document_analysis_client = DocumentAnalysisClient(endpoint=endpoint, credential=AzureKeyCredential(key))
 
-# Define the folder containing your sample invoices
-invoices_folder = "./invoice_temp_storage/"
+# Folders are passed in by the API, so they match its configuration
+invoices_folder = os.getenv("INVOICING_UPLOAD_FOLDER", "./invoice_temp_storage/")
+extracted_folder = os.getenv("INVOICING_EXTRACTED_FOLDER", "extracted_invoices")
 
 # List to store extracted data
 extracted_data = []
-
-# Find all PDF and image files in the folder
-invoice_files = glob.glob(os.path.join(invoices_folder, "*.pdf")) + \
-                glob.glob(os.path.join(invoices_folder, "*.png")) + \
-                glob.glob(os.path.join(invoices_folder, "*.jpg")) + \
-                glob.glob(os.path.join(invoices_folder, "*.jpeg"))
+# Invoices to record in the persistent registry
+registry_entries = []
+
+# The upload manifest says which files still need extracting
+manifest = UploadManifest()
+# Pick up files that reached the folder without going through an upload
+manifest.sync(invoices_folder, {"pdf", "png", "jpg", "jpeg"})
+
+invoice_files = [os.path.join(invoices_folder, filename) for filename in manifest.pending()]
+
+# Files queued without going through an upload (e.g. found by sync) haven't
+# been pre-flight checked yet, so check them before spending remote calls.
+# This runs inline: the script has no __main__ guard for pool workers to import.
+unchecked = [path for path in invoice_files if not manifest.get(os.path.basename(path))["metadata"]]
+for check in map(preflight.check_file, unchecked):
+    metadata = {key: check[key] for key in ("kind", "pages", "encrypted", "has_text", "width", "height")}
+    if check["ok"]:
+        manifest.set_metadata(check["file"], metadata)
+    else:
+        print(f"Skipping {check['file']}: {check['reason']}")
+        manifest.mark_rejected(check["file"], check["reason"], metadata)
+        invoice_files.remove(os.path.join(invoices_folder, check["file"]))
 
 print(f"Looking for invoices in: {invoices_folder}")
 print("\nFound these files:")
 for file in invoice_files:
     print(f"- {file}")
 
-if not invoice_files:
+if not invoice_files and not manifest.entries():
     print(f"No invoice files found in {invoices_folder}. Please add some sample invoices.")
+    # An empty output still replaces the last one, so deleted invoices drop out of the results
+    output_file = get_next_filename(os.path.join(extracted_folder, "extracted_invoices.csv"))
+    manifest.write_extracted_csv(output_file)
 else:
     print(f"\nFound {len(invoice_files)} files to process.")
+    # Azure bills per page; files without a known page count are assumed to be one page
+    estimated_pages = sum((manifest.get(os.path.basename(path))["metadata"] or {}).get("pages") or 1 for path in invoice_files)
+    cost_per_1000_pages = float(os.getenv("INVOICING_COST_PER_1000_PAGES", "10"))
+    print(f"Estimated {estimated_pages} pages, about ${estimated_pages * cost_per_1000_pages / 1000:.2f} to analyze.")
+    write_progress(0, len(invoice_files))
 
     # --- Extraction Loop ---
-    for invoice_path in invoice_files:
+    for processed, invoice_path in enumerate(invoice_files, start=1):
         print(f"\nProcessing invoice: {invoice_path}")
         try:
             # Read the invoice file in binary mode
@@ -81,6 +118,7 @@ else:
                 total_amount = invoice_document.fields.get("InvoiceTotal")
                 net_total = invoice_document.fields.get("SubTotal")
                 tax_total = invoice_document.fields.get("TotalTax")
+                vendor_name = invoice_document.fields.get("VendorName")
 
                 # For descriptions or line items, it's slightly more complex
                 # The 'Items' field is a list of objects (line items)
@@ -100,6 +138,7 @@ else:
                 extracted_data.append({
                     "File Path": invoice_path,
                     "Invoice ID": invoice_id.value if invoice_id else None,
+                    "Supplier": vendor_name.value if vendor_name else None,
                     "Invoice Date": invoice_date.value if invoice_date else None,
                     "Net Total": str(net_total.value).replace('Â£', '£') if net_total and net_total.value else "0",
                     "Tax Total": str(tax_total.value).replace('Â£', '£') if tax_total and tax_total.value else "0",
@@ -107,7 +146,20 @@ else:
                     "Descriptions": descriptions_text
                 })
 
+                if invoice_id and invoice_id.value:
+                    registry_entries.append({
+                        "invoice_id": invoice_id.value,
+                        "supplier": vendor_name.value if vendor_name else None,
+                        "invoice_date": invoice_date.value.isoformat() if invoice_date and invoice_date.value else None,
+                        "total_amount": total_amount.value.amount if total_amount and total_amount.value else None,
+                        "content_hash": hashlib.sha256(invoice_bytes).hexdigest(),
+                        "file_path": invoice_path,
+                    })
+
+                manifest.mark_extracted(os.path.basename(invoice_path), extracted_data[-1]["Invoice ID"], extracted_data[-1])
+
                 print(f"  - Extracted ID: {extracted_data[-1]['Invoice ID']}")
+                print(f"  - Extracted Supplier: {extracted_data[-1]['Supplier']}")
                 print(f"  - Extracted Date: {extracted_data[-1]['Invoice Date']}")
                 print(f"  - Extracted Net Total: {extracted_data[-1]['Net Total']}")
                 print(f"  - Extracted Tax Total: {extracted_data[-1]['Tax Total']}")
@@ -116,19 +168,28 @@ else:
 
             else:
                 print(f"  - No document found in the result for {invoice_path}. Extraction might have failed.")
+                manifest.mark_failed(os.path.basename(invoice_path), "No document found in the analysis result")
 
         except Exception as e:
             print(f"  - Error processing {invoice_path}: {e}")
             extracted_data.append({
                 "File Path": invoice_path,
                 "Invoice ID": "ERROR",
+                "Supplier": "ERROR",
                 "Invoice Date": "ERROR",
                 "Net Total": "ERROR",
                 "Tax Total": "ERROR",
                 "Total Amount": "ERROR",
                 "Descriptions": f"Error: {e}"
             })
+            manifest.mark_failed(os.path.basename(invoice_path), e, extracted_data[-1])
 
+        write_progress(processed, len(invoice_files))
+
+
+    # The output covers every file still uploaded, not just the ones extracted
+    # in this run, so deleted files drop out and unchanged ones aren't re-sent
+    extracted_data = manifest.extracted_rows()
 
     # Convert extracted data to a pandas DataFrame
     df_extracted = pd.DataFrame(extracted_data)
@@ -138,6 +199,29 @@ else:
     print(df_extracted.to_string()) # Use to_string() to see all rows if many
 
     # Save extracted data to a CSV with incrementing number if file exists
-    output_file = get_next_filename("extracted_invoices/extracted_invoices.csv")
-    df_extracted.to_csv(output_file, index=False, encoding='utf-8-sig')
+    output_file = get_next_filename(os.path.join(extracted_folder, "extracted_invoices.csv"))
+    manifest.write_extracted_csv(output_file)
     print(f"\nExtracted data saved to {output_file}")
+
+    # Record the run in the registry and flag invoices billed in earlier batches
+    registry = invoice_registry.connect()
+    try:
+        duplicates = invoice_registry.register_invoices(registry, registry_entries, source_file=output_file)
+    finally:
+        registry.close()
+    print(f"Recorded {len(registry_entries)} invoices in the invoice registry.")
+    for invoice, existing in duplicates:
+        previous = ", ".join(f"{row['file_path']} ({row['extracted_at']})" for row in existing)
+        print(f"  - Possible duplicate: Invoice ID {invoice['invoice_id']} from {invoice['file_path']} was already extracted from {previous}")
+
+    # Keep the duplicates on each file's manifest entry so the API can report them.
+    # Every file extracted in this run is updated, clearing duplicates found earlier.
+    duplicates_by_file = {os.path.basename(invoice["file_path"]): [dict(row) for row in existing] for invoice, existing in duplicates}
+    for invoice in registry_entries:
+        filename = os.path.basename(invoice["file_path"])
+        entry = manifest.get(filename)
+        if entry is None:
+            continue
+        metadata = dict(entry["metadata"] or {})
+        metadata["possible_duplicates"] = duplicates_by_file.get(filename, [])
+        manifest.set_metadata(filename, metadata)
@@ -0,0 +1,126 @@
+"""Persistent registry of every extracted invoice.
+
+Each extraction run writes its invoices here as well as to its own CSV, so
+duplicates can be found across batches with an indexed lookup instead of
+rereading every old extracted_invoices_N.csv.
+"""
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+DEFAULT_DB = "invoice_registry.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    invoice_id TEXT NOT NULL,
+    supplier TEXT,
+    supplier_key TEXT NOT NULL DEFAULT '',
+    invoice_date TEXT,
+    total_amount REAL,
+    content_hash TEXT NOT NULL UNIQUE,
+    file_path TEXT,
+    source_file TEXT,
+    extracted_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_invoices_invoice_id ON invoices (invoice_id, supplier_key);
+CREATE INDEX IF NOT EXISTS idx_invoices_supplier ON invoices (supplier_key, invoice_date);
+CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (invoice_date);
+"""
+
+def connect(path=None):
+    """Open the registry, creating the database and its indexes if needed."""
+    path = path or os.getenv("INVOICING_REGISTRY_DB", DEFAULT_DB)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # WAL lets API workers read while an extraction run is writing
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def supplier_key(name):
+    """Case-insensitive supplier key, blank when the supplier is unknown."""
+    if name is None or name != name: # None or NaN
+        return ""
+    return str(name).strip().casefold()
+
+def find_by_hash(conn, file_hash):
+    """Return the registered invoice with this content hash, or None."""
+    return conn.execute("SELECT * FROM invoices WHERE content_hash = ?", (file_hash,)).fetchone()
+
+def find_duplicates(conn, invoice_id, supplier=None, exclude_hash=None):
+    """Return registered invoices with the same Invoice ID (and supplier, when known)."""
+    query = "SELECT * FROM invoices WHERE invoice_id = ?"
+    params = [str(invoice_id).strip()]
+    key = supplier_key(supplier)
+    if key:
+        query += " AND supplier_key IN (?, '')"
+        params.append(key)
+    if exclude_hash:
+        query += " AND content_hash != ?"
+        params.append(exclude_hash)
+    return conn.execute(query, params).fetchall()
+
+def register_invoices(conn, invoices, source_file=None):
+    """Record extracted invoices and return any earlier invoices they duplicate.
+
+    ``invoices`` are dicts with invoice_id, supplier, invoice_date,
+    total_amount, content_hash and file_path. Re-extracting a file already in
+    the registry refreshes its row rather than reporting it as a duplicate.
+    Returns a list of (invoice, [existing rows]) pairs.
+    """
+    extracted_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    duplicates = []
+    with conn:
+        for invoice in invoices:
+            existing = find_duplicates(conn, invoice["invoice_id"], invoice.get("supplier"), exclude_hash=invoice["content_hash"])
+            if existing:
+                duplicates.append((invoice, existing))
+            conn.execute(
+                """
+                INSERT INTO invoices (invoice_id, supplier, supplier_key, invoice_date, total_amount,
+                                      content_hash, file_path, source_file, extracted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (content_hash) DO UPDATE SET
+                    invoice_id = excluded.invoice_id,
+                    supplier = excluded.supplier,
+                    supplier_key = excluded.supplier_key,
+                    invoice_date = excluded.invoice_date,
+                    total_amount = excluded.total_amount,
+                    file_path = excluded.file_path,
+                    source_file = excluded.source_file,
+                    extracted_at = excluded.extracted_at
+                """,
+                (
+                    str(invoice["invoice_id"]).strip(),
+                    invoice.get("supplier"),
+                    supplier_key(invoice.get("supplier")),
+                    invoice.get("invoice_date"),
+                    invoice.get("total_amount"),
+                    invoice["content_hash"],
+                    invoice.get("file_path"),
+                    source_file,
+                    extracted_at,
+                ),
+            )
+    return duplicates
+
+def history(conn, start_date=None, end_date=None, supplier=None, limit=None):
+    """Return registered invoices in extraction order, filtered by invoice date (YYYY-MM-DD) and supplier."""
+    query = "SELECT * FROM invoices WHERE 1 = 1"
+    params = []
+    if start_date:
+        query += " AND invoice_date >= ?"
+        params.append(start_date)
+    if end_date:
+        # Dates may carry a time part, so compare against the start of the next day
+        query += " AND invoice_date < date(?, '+1 day')"
+        params.append(end_date)
+    if supplier:
+        query += " AND supplier_key = ?"
+        params.append(supplier_key(supplier))
+    query += " ORDER BY id"
+    if limit:
+        query += " LIMIT ?"
+        params.append(int(limit))
+    return conn.execute(query, params).fetchall()
@@ -0,0 +1,171 @@
+"""Pre-flight checks for uploaded invoices.
+
+Runs at upload time, before anything is sent to Azure, so corrupt, empty,
+encrypted or oversized documents are rejected in milliseconds with a clear
+reason instead of failing minutes into an extraction batch. Files that pass
+are tagged with metadata (type, pages, text layer, dimensions) that the
+extractor uses for cost estimates.
+"""
+import os
+import re
+import struct
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+MAX_BYTES = int(os.getenv("INVOICING_MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+MAX_PAGES = int(os.getenv("INVOICING_MAX_PAGES", 50))
+# Azure Document Intelligence accepts images between 50x50 and 10000x10000 pixels
+MIN_DIMENSION = 50
+MAX_DIMENSION = 10000
+# Every API worker gets its own pool, so keep each one small
+POOL_WORKERS = int(os.getenv("INVOICING_PREFLIGHT_WORKERS", 2))
+
+SIGNATURES = {
+    'pdf': b"%PDF-",
+    'png': b"\x89PNG\r\n\x1a\n",
+    'jpeg': b"\xff\xd8\xff",
+}
+EXTENSION_KINDS = {'pdf': 'pdf', 'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg'}
+
+_pool = None
+_pool_pid = None
+
+class PreflightError(Exception):
+    """Raised when a document should not be sent for extraction."""
+
+def _detect_kind(data):
+    for kind, signature in SIGNATURES.items():
+        if data.startswith(signature):
+            return kind
+    return None
+
+def _pdf_info(path, data):
+    """Return (pages, encrypted, has_text) for a PDF."""
+    # A PDF that was cut off mid-upload has no end-of-file marker
+    if b"%%EOF" not in data[-2048:]:
+        raise PreflightError("Truncated PDF (no end-of-file marker)")
+
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        PdfReader = None
+
+    if PdfReader is None:
+        # Byte-level fallback. Page objects inside compressed object streams
+        # aren't visible, in which case the page tree's /Count is used instead.
+        pages = len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", data))
+        if not pages:
+            counts = [int(count) for count in re.findall(rb"/Count\s+(\d+)", data)]
+            pages = max(counts) if counts else None
+        return pages, b"/Encrypt" in data, b"/Font" in data
+
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            return None, True, False
+        pages = len(reader.pages)
+        has_text = bool(pages and reader.pages[0].extract_text().strip())
+    except Exception as e:
+        raise PreflightError(f"Corrupt PDF: {e}")
+    return pages, False, has_text
+
+def _png_dimensions(data):
+    # Width and height are the first fields of the IHDR chunk
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        raise PreflightError("Corrupt PNG (missing IHDR header)")
+    return struct.unpack(">II", data[16:24])
+
+def _jpeg_dimensions(data):
+    # Walk the marker segments until a start-of-frame, which holds the size
+    offset = 2
+    while offset + 9 < len(data):
+        if data[offset] != 0xFF:
+            raise PreflightError("Corrupt JPEG (bad marker)")
+        marker = data[offset + 1]
+        if marker == 0xFF: # Fill byte
+            offset += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        offset += 2 + length
+    raise PreflightError("Corrupt JPEG (no frame header)")
+
+def check_file(path):
+    """Check one uploaded document.
+
+    Returns a dict with 'ok' and 'reason' plus the metadata collected
+    (kind, size, content_hash, pages, encrypted, has_text, width, height).
+    """
+    result = {
+        'file': os.path.basename(path), 'ok': False, 'reason': None,
+        'kind': None, 'size': 0, 'content_hash': None,
+        'pages': None, 'encrypted': False, 'has_text': None, 'width': None, 'height': None,
+    }
+    try:
+        size = os.path.getsize(path)
+        result['size'] = size
+        if size == 0:
+            raise PreflightError("Empty file")
+        if size > MAX_BYTES:
+            raise PreflightError(f"File is {size / (1024 * 1024):.1f} MB, over the {MAX_BYTES / (1024 * 1024):.0f} MB limit")
+
+        with open(path, "rb") as f:
+            data = f.read()
+        result['content_hash'] = hashlib.sha256(data).hexdigest()
+
+        kind = _detect_kind(data)
+        expected = EXTENSION_KINDS.get(path.rsplit('.', 1)[-1].lower())
+        if kind is None:
+            raise PreflightError("Not a PDF, PNG or JPEG file")
+        if expected and kind != expected:
+            raise PreflightError(f"File contents are {kind.upper()} but the extension says {expected.upper()}")
+        result['kind'] = kind
+
+        if kind == 'pdf':
+            pages, encrypted, has_text = _pdf_info(path, data)
+            result.update(pages=pages, encrypted=encrypted, has_text=has_text)
+            if encrypted:
+                raise PreflightError("PDF is encrypted")
+            if pages == 0:
+                raise PreflightError("PDF has no pages")
+            if pages and pages > MAX_PAGES:
+                raise PreflightError(f"PDF has {pages} pages, over the {MAX_PAGES} page limit")
+        else:
+            width, height = _png_dimensions(data) if kind == 'png' else _jpeg_dimensions(data)
+            result.update(pages=1, has_text=False, width=width, height=height)
+            if min(width, height) < MIN_DIMENSION or max(width, height) > MAX_DIMENSION:
+                raise PreflightError(
+                    f"Image is {width}x{height}px; it must be between {MIN_DIMENSION} and {MAX_DIMENSION}px on each side"
+                )
+
+        result['ok'] = True
+    except PreflightError as e:
+        result['reason'] = str(e)
+    except OSError as e:
+        result['reason'] = f"Could not read file: {e}"
+    return result
+
+def _get_pool():
+    # One pool per worker process, created on first use and never shared across a fork
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        _pool_pid = os.getpid()
+    return _pool
+
+def check_files(paths):
+    """Check several documents in parallel, returning results in the same order."""
+    if len(paths) <= 1:
+        # Not worth a round trip to the pool
+        return [check_file(path) for path in paths]
+    global _pool
+    try:
+        return list(_get_pool().map(check_file, paths))
+    except BrokenProcessPool:
+        # A pool worker died (e.g. killed for memory); start a fresh pool next time
+        _pool.shutdown(wait=False)
+        _pool = None
+        return [check_file(path) for path in paths]
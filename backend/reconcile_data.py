@@ -1,6 +1,27 @@
 import pandas as pd
 import os
 import glob
+import sys
+import json
+import math
+import mmap
+import time
+import zlib
+import heapq
+import tempfile
+import argparse
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+import invoice_registry
+import export_results
+
+EXPECTED_ID_COL = "Expected Invoice ID"
+EXPECTED_TOTAL_COL = "Expected Total Amount"
+
+# Folders are passed in by the API, so they match its configuration
+EXTRACTED_FOLDER = os.getenv("INVOICING_EXTRACTED_FOLDER", "extracted_invoices")
+RESULTS_FOLDER = os.getenv("INVOICING_RESULTS_FOLDER", "reconcilliation_results")
+STATEMENT_FILE = os.path.join(os.getenv("INVOICING_STATEMENT_FOLDER", "."), "supplier_statement.csv")
 
 def get_most_recent_file(pattern):
     """Find the most recent file matching the pattern."""
@@ -19,128 +40,129 @@ def get_next_filename(base_name):
         counter += 1
     return filename
 
-# --- Define File Paths ---
-extracted_data_file = get_most_recent_file("extracted_invoices/extracted_invoices*.csv")
-statement_file = "supplier_statement.csv"
-
-# --- Load Data ---
-if not extracted_data_file:
-    print("Error: No extracted invoices file found.")
-    print("Please run extract_invoices.py first to generate this file.")
-    exit()
-
-print(f"Loading extracted data from: {extracted_data_file}")
-
-try:
-    df_extracted = pd.read_csv(extracted_data_file)
+def parse_amount(x):
+    """Convert an amount such as '£1,349.40' to a float, or 0.0 if it isn't a plain amount."""
+    cleaned = str(x).replace('Â£', '').replace('£', '').replace(',', '')
+    if isinstance(x, (int, float, str)) and cleaned.replace('.', '', 1).isdigit():
+        return float(cleaned)
+    return 0.0
+
+def normalise_supplier(name):
+    """Supplier key used by the batch index: case-insensitive, blank when unknown."""
+    if pd.isna(name):
+        return ""
+    return str(name).strip().casefold()
+
+def clean_ids(ids):
+    """Strip Invoice IDs, turning blanks into "None" so they are skipped like other bad values.
+
+    Blank IDs are read as NaN, which older pandas turns into the string "nan"
+    and newer pandas keeps as NaN.
+    """
+    return ids.fillna("None").astype(str).str.strip().replace("", "None")
+
+def load_extracted(path):
+    """Load an extracted invoices CSV with cleaned IDs and numeric totals."""
+    # Read IDs and totals as text so type inference can't turn 66481 into 66481.0
+    df_extracted = pd.read_csv(path, dtype={'Invoice ID': str, 'Total Amount': str})
     # Ensure Invoice ID is treated as string to avoid issues with numerical IDs
-    df_extracted['Invoice ID'] = df_extracted['Invoice ID'].astype(str).str.strip()
+    df_extracted['Invoice ID'] = clean_ids(df_extracted['Invoice ID'])
     # Convert Total Amount to numeric, handling currency symbols
-    df_extracted['Total Amount'] = df_extracted['Total Amount'].apply(
-        lambda x: float(str(x).replace('Â£', '').replace('£', '').replace(',', '')) 
-        if isinstance(x, (int, float, str)) and str(x).replace('Â£', '').replace('£', '').replace(',', '').replace('.', '', 1).isdigit() 
-        else 0.0
-    )
-    print(f"Successfully loaded {len(df_extracted)} extracted records.")
-
-except Exception as e:
-    print(f"Error loading extracted data from {extracted_data_file}: {e}")
-    exit()
+    df_extracted['Total Amount'] = df_extracted['Total Amount'].apply(parse_amount)
+    # Older extraction runs did not record the supplier
+    if 'Supplier' not in df_extracted.columns:
+        df_extracted['Supplier'] = ""
+    return df_extracted
 
+def load_supplier_statement(path):
+    """Load a supplier statement CSV with cleaned IDs and numeric totals."""
+    df_statement = pd.read_csv(path, dtype={EXPECTED_ID_COL: str, EXPECTED_TOTAL_COL: str})
 
-print(f"Loading supplier statement from: {statement_file}")
-if not os.path.exists(statement_file):
-    print(f"Error: Supplier statement file not found at {statement_file}.")
-    print("Please create the supplier_statement.csv file as described in the previous step.")
-    exit()
-
-try:
-    df_statement = pd.read_csv(statement_file)
-    # Ensure column names match your CSV file
-    expected_id_col = "Expected Invoice ID"
-    expected_total_col = "Expected Total Amount"
-
-    if expected_id_col not in df_statement.columns or expected_total_col not in df_statement.columns:
-         print(f"Error: Statement CSV must contain '{expected_id_col}' and '{expected_total_col}' columns.")
-         exit()
+    if EXPECTED_ID_COL not in df_statement.columns or EXPECTED_TOTAL_COL not in df_statement.columns:
+        raise ValueError(f"Statement CSV must contain '{EXPECTED_ID_COL}' and '{EXPECTED_TOTAL_COL}' columns.")
 
     # Ensure Expected Invoice ID is treated as string
-    df_statement[expected_id_col] = df_statement[expected_id_col].astype(str).str.strip()
+    df_statement[EXPECTED_ID_COL] = clean_ids(df_statement[EXPECTED_ID_COL])
     # Convert Expected Total Amount to numeric, handling currency symbols
-    df_statement[expected_total_col] = df_statement[expected_total_col].apply(
-        lambda x: float(str(x).replace('Â£', '').replace('£', '').replace(',', '')) 
-        if isinstance(x, (int, float, str)) and str(x).replace('Â£', '').replace('£', '').replace(',', '').replace('.', '', 1).isdigit() 
-        else 0.0
-    )
-    print(f"Successfully loaded {len(df_statement)} statement records.")
-
-except Exception as e:
-    print(f"Error loading supplier statement from {statement_file}: {e}")
-    exit()
-
-
-# --- Reconciliation Logic ---
-print("\n--- Performing Reconciliation ---")
-
-# Prepare Data for Comparison
-# Create dictionaries for quick lookups, handling potential None/NaN values and stripping whitespace
-extracted_dict = {
-    row["Invoice ID"]: row
-    for index, row in df_extracted.iterrows()
-    if pd.notna(row["Invoice ID"]) and row["Invoice ID"] != "ERROR" and row["Invoice ID"] != "None" # Handle various potential bad values
-}
-
-print("\nExtracted Invoice IDs:", list(extracted_dict.keys()))
-
-statement_dict = {
-    row[expected_id_col]: row
-    for index, row in df_statement.iterrows()
-    if pd.notna(row[expected_id_col]) and row[expected_id_col] != "None"
-}
-
-print("Statement Invoice IDs:", list(statement_dict.keys()))
-
-# --- Perform Comparisons ---
-
-# 1. Check for Missing Invoices (In statement but not extracted)
-missing_invoices = []
-for statement_id in statement_dict:
-    if statement_id not in extracted_dict:
-        missing_invoices.append(statement_id)
-
-if missing_invoices:
-    print(f"\nMissing Invoices (in statement but not extracted): {', '.join(missing_invoices)}")
-else:
-    print("\nNo missing invoices found.")
-
-# 2. Check for Extra Invoices (Extracted but not in statement)
-extra_invoices = []
-for extracted_id in extracted_dict:
-     if extracted_id not in statement_dict:
-         extra_invoices.append(extracted_id)
-
-if extra_invoices:
-     print(f"\nExtra Invoices (extracted but not in statement): {', '.join(extra_invoices)}")
-else:
-     print("\nNo extra invoices found.")
-
-
-# 3. Check for Total Amount Discrepancies (Only for invoices found in both)
-discrepancies = []
-total_extracted_matched = 0.0
-total_expected_matched = 0.0
-
-for statement_id, statement_row in statement_dict.items():
-    if statement_id in extracted_dict:
-        extracted_row = extracted_dict[statement_id]
-
-        expected_total = statement_row[expected_total_col]
-        extracted_total = extracted_row["Total Amount"]
-
-        # Check if both totals are valid numbers before comparing
-        if pd.notna(expected_total) and pd.notna(extracted_total):
-            total_expected_matched += expected_total
-            total_extracted_matched += extracted_total
+    df_statement[EXPECTED_TOTAL_COL] = df_statement[EXPECTED_TOTAL_COL].apply(parse_amount)
+    return df_statement
+
+def _result_row(status, invoice_id, expected_total, extracted_total):
+    """Format one reconciliation result row."""
+    if status == "Missing":
+        return {
+            "Invoice ID": invoice_id,
+            "Status": status,
+            "Expected Total": f"£{expected_total:.2f}",
+            "Extracted Total": "£0.00",
+            "Difference": f"£{-expected_total:.2f}"
+        }
+    if status == "Extra":
+        return {
+            "Invoice ID": invoice_id,
+            "Status": status,
+            "Expected Total": "£0.00",
+            "Extracted Total": f"£{extracted_total:.2f}",
+            "Difference": f"£{extracted_total:.2f}"
+        }
+    return {
+        "Invoice ID": invoice_id,
+        "Status": status,
+        "Expected Total": f"£{expected_total:.2f}",
+        "Extracted Total": f"£{extracted_total:.2f}",
+        "Difference": f"£{extracted_total - expected_total:.2f}" if status == "Discrepancy" else "£0.00"
+    }
+
+def _summary_row(statement_sum, extracted_sum):
+    return {
+        "Invoice ID": "SUMMARY",
+        "Status": "Totals",
+        "Expected Total": f"£{statement_sum:.2f}",
+        "Extracted Total": f"£{extracted_sum:.2f}",
+        "Difference": f"£{extracted_sum - statement_sum:.2f}"
+    }
+
+def reconcile(extracted_rows, statement_rows, verbose=True):
+    """Reconcile extracted invoices against a supplier statement.
+
+    Both arguments are sequences of (invoice_id, total) pairs in file order.
+    Returns the result rows in the order they are written to the results CSV.
+    """
+    # Create dictionaries for quick lookups. Comparisons use the last row seen
+    # for an ID, while Missing/Extra report the first one.
+    extracted_first = {}
+    extracted_dict = {}
+    for invoice_id, total in extracted_rows:
+        if invoice_id != "ERROR" and invoice_id != "None": # Handle various potential bad values
+            extracted_first.setdefault(invoice_id, total)
+            extracted_dict[invoice_id] = total
+
+    statement_first = {}
+    statement_dict = {}
+    for invoice_id, total in statement_rows:
+        if invoice_id != "None":
+            statement_first.setdefault(invoice_id, total)
+            statement_dict[invoice_id] = total
+
+    if verbose:
+        print("\nExtracted Invoice IDs:", list(extracted_dict.keys()))
+        print("Statement Invoice IDs:", list(statement_dict.keys()))
+
+    # 1. Check for Missing Invoices (In statement but not extracted)
+    missing_invoices = [statement_id for statement_id in statement_dict if statement_id not in extracted_dict]
+
+    # 2. Check for Extra Invoices (Extracted but not in statement)
+    extra_invoices = [extracted_id for extracted_id in extracted_dict if extracted_id not in statement_dict]
+
+    # 3. Check for Total Amount Discrepancies (Only for invoices found in both)
+    discrepancies = []
+    total_extracted_matched = []
+    total_expected_matched = []
+    for statement_id, expected_total in statement_dict.items():
+        if statement_id in extracted_dict:
+            extracted_total = extracted_dict[statement_id]
+            total_expected_matched.append(expected_total)
+            total_extracted_matched.append(extracted_total)
 
             if abs(expected_total - extracted_total) > 0.01: # Allow for small floating point differences
                 discrepancies.append({
@@ -148,86 +170,547 @@ for statement_id, statement_row in statement_dict.items():
                     "Expected Total": expected_total,
                     "Extracted Total": extracted_total
                 })
+
+    # fsum keeps the totals independent of the order rows were added in
+    extracted_sum = math.fsum(total for _, total in extracted_rows)
+    statement_sum = math.fsum(total for _, total in statement_rows)
+
+    if verbose:
+        if missing_invoices:
+            print(f"\nMissing Invoices (in statement but not extracted): {', '.join(missing_invoices)}")
         else:
-             # Handle cases where one or both totals were not successfully loaded/extracted as numbers
-             print(f"  - Could not compare totals for {statement_id}: Expected or Extracted Total is not a valid number.")
+            print("\nNo missing invoices found.")
 
+        if extra_invoices:
+            print(f"\nExtra Invoices (extracted but not in statement): {', '.join(extra_invoices)}")
+        else:
+            print("\nNo extra invoices found.")
 
-if discrepancies:
-    print("\nTotal Amount Discrepancies (for invoices found in both):")
-    for disc in discrepancies:
-        print(f"  - Invoice ID: {disc['Invoice ID']}, Expected: £{disc['Expected Total']:.2f}, Extracted: £{disc['Extracted Total']:.2f}")
-else:
-     print("\nNo significant total amount discrepancies found for matched invoices.")
+        if discrepancies:
+            print("\nTotal Amount Discrepancies (for invoices found in both):")
+            for disc in discrepancies:
+                print(f"  - Invoice ID: {disc['Invoice ID']}, Expected: £{disc['Expected Total']:.2f}, Extracted: £{disc['Extracted Total']:.2f}")
+        else:
+            print("\nNo significant total amount discrepancies found for matched invoices.")
 
-# 4. Overall Totals (Optional but helpful)
-print("\nOverall Totals:")
-# Sum extracted totals, excluding NaNs from conversion errors
-print(f"  - Total of all extracted invoices (successfully parsed total): £{df_extracted['Total Amount'].sum():.2f}")
-print(f"  - Total of expected invoices (from statement): £{df_statement[expected_total_col].sum():.2f}")
+        print("\nOverall Totals:")
+        print(f"  - Total of all extracted invoices (successfully parsed total): £{extracted_sum:.2f}")
+        print(f"  - Total of expected invoices (from statement): £{statement_sum:.2f}")
+        print(f"  - Total of extracted invoices found in statement: £{math.fsum(total_extracted_matched):.2f}")
+        print(f"  - Total of expected invoices found in extraction: £{math.fsum(total_expected_matched):.2f}")
 
-print(f"  - Total of extracted invoices found in statement: £{total_extracted_matched:.2f}")
-print(f"  - Total of expected invoices found in extraction: £{total_expected_matched:.2f}") # Should be the same as total_extracted_matched for matched invoices
+    reconciliation_results = []
 
-# Save reconciliation results to CSV
-reconciliation_results = []
+    # Add missing invoices
+    for invoice_id in missing_invoices:
+        reconciliation_results.append(_result_row("Missing", invoice_id, statement_first[invoice_id], 0.0))
 
-# Add missing invoices
-for invoice_id in missing_invoices:
-    reconciliation_results.append({
-        "Invoice ID": invoice_id,
-        "Status": "Missing",
-        "Expected Total": f"£{df_statement[df_statement[expected_id_col] == invoice_id][expected_total_col].iloc[0]:.2f}",
-        "Extracted Total": "£0.00",
-        "Difference": f"£{-df_statement[df_statement[expected_id_col] == invoice_id][expected_total_col].iloc[0]:.2f}"
-    })
-
-# Add extra invoices
-for invoice_id in extra_invoices:
-    reconciliation_results.append({
-        "Invoice ID": invoice_id,
-        "Status": "Extra",
-        "Expected Total": "£0.00",
-        "Extracted Total": f"£{df_extracted[df_extracted['Invoice ID'] == invoice_id]['Total Amount'].iloc[0]:.2f}",
-        "Difference": f"£{df_extracted[df_extracted['Invoice ID'] == invoice_id]['Total Amount'].iloc[0]:.2f}"
-    })
-
-# Add discrepancies
-for disc in discrepancies:
-    reconciliation_results.append({
-        "Invoice ID": disc["Invoice ID"],
-        "Status": "Discrepancy",
-        "Expected Total": f"£{disc['Expected Total']:.2f}",
-        "Extracted Total": f"£{disc['Extracted Total']:.2f}",
-        "Difference": f"£{disc['Extracted Total'] - disc['Expected Total']:.2f}"
-    })
-
-# Add matched invoices (those that exist in both and have matching amounts)
-for statement_id in statement_dict:
-    if statement_id in extracted_dict and statement_id not in [d["Invoice ID"] for d in discrepancies]:
-        reconciliation_results.append({
-            "Invoice ID": statement_id,
-            "Status": "Matched",
-            "Expected Total": f"£{statement_dict[statement_id][expected_total_col]:.2f}",
-            "Extracted Total": f"£{extracted_dict[statement_id]['Total Amount']:.2f}",
-            "Difference": "£0.00"
-        })
-
-# Add summary row
-reconciliation_results.append({
-    "Invoice ID": "SUMMARY",
-    "Status": "Totals",
-    "Expected Total": f"£{df_statement[expected_total_col].sum():.2f}",
-    "Extracted Total": f"£{df_extracted['Total Amount'].sum():.2f}",
-    "Difference": f"£{df_extracted['Total Amount'].sum() - df_statement[expected_total_col].sum():.2f}"
-})
-
-# Convert to DataFrame and save
-df_results = pd.DataFrame(reconciliation_results)
-# Replace any remaining None or NaN values with £0.00
-df_results = df_results.fillna("£0.00")
-results_file = get_next_filename("reconcilliation_results/reconciliation_results.csv")
-df_results.to_csv(results_file, index=False, encoding='utf-8-sig')
-print(f"\nReconciliation results saved to {results_file}")
-
-print("\nReconciliation complete.")
\ No newline at end of file
+    # Add extra invoices
+    for invoice_id in extra_invoices:
+        reconciliation_results.append(_result_row("Extra", invoice_id, 0.0, extracted_first[invoice_id]))
+
+    # Add discrepancies
+    for disc in discrepancies:
+        reconciliation_results.append(_result_row("Discrepancy", disc["Invoice ID"], disc["Expected Total"], disc["Extracted Total"]))
+
+    # Add matched invoices (those that exist in both and have matching amounts)
+    discrepancy_ids = {disc["Invoice ID"] for disc in discrepancies}
+    for statement_id in statement_dict:
+        if statement_id in extracted_dict and statement_id not in discrepancy_ids:
+            reconciliation_results.append(_result_row("Matched", statement_id, statement_dict[statement_id], extracted_dict[statement_id]))
+
+    # Add summary row
+    reconciliation_results.append(_summary_row(statement_sum, extracted_sum))
+
+    return reconciliation_results
+
+def save_results(reconciliation_results, results_file):
+    """Write reconciliation results to CSV in the format the API serves."""
+    df_results = pd.DataFrame(reconciliation_results)
+    # Replace any remaining None or NaN values with £0.00
+    df_results = df_results.fillna("£0.00")
+    df_results.to_csv(results_file, index=False, encoding='utf-8-sig')
+
+# --- Batch Reconciliation ---
+# The invoice index is written once and memory-mapped by every worker, so the
+# extracted data is never pickled per statement and the OS shares its pages.
+
+_index = None
+_index_offsets = None
+
+def build_invoice_index(extracted_files, index_path):
+    """Write the shared invoice index and return {supplier: (start, end)} byte ranges.
+
+    Rows are grouped by supplier, keeping file order within each supplier, one
+    JSON [invoice_id, total] pair per line.
+    """
+    supplier_rows = {}
+    for path in extracted_files:
+        df_extracted = load_extracted(path)
+        for supplier, invoice_id, total in zip(df_extracted['Supplier'], df_extracted['Invoice ID'], df_extracted['Total Amount']):
+            supplier_rows.setdefault(normalise_supplier(supplier), []).append((invoice_id, total))
+
+    offsets = {}
+    with open(index_path, 'wb') as f:
+        for supplier, rows in supplier_rows.items():
+            start = f.tell()
+            for invoice_id, total in rows:
+                f.write(json.dumps([invoice_id, total]).encode('utf-8') + b"\n")
+            offsets[supplier] = (start, f.tell())
+    return offsets
+
+def _init_worker(index_path, offsets):
+    global _index, _index_offsets
+    _index_offsets = offsets
+    if os.path.getsize(index_path) == 0:
+        _index = b""
+        return
+    with open(index_path, 'rb') as f:
+        _index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _reconcile_statement(statement_path, supplier, results_file):
+    started = time.perf_counter()
+    df_statement = load_supplier_statement(statement_path)
+
+    # run_batch only submits suppliers present in the index
+    start, end = _index_offsets[supplier]
+    extracted_rows = [tuple(json.loads(line)) for line in _index[start:end].splitlines()]
+    statement_rows = list(zip(df_statement[EXPECTED_ID_COL], df_statement[EXPECTED_TOTAL_COL]))
+
+    reconciliation_results = reconcile(extracted_rows, statement_rows, verbose=False)
+    save_results(reconciliation_results, results_file)
+
+    summary = reconciliation_results[-1]
+    statuses = [row["Status"] for row in reconciliation_results[:-1]]
+    return {
+        "Matched": statuses.count("Matched"),
+        "Missing": statuses.count("Missing"),
+        "Extra": statuses.count("Extra"),
+        "Discrepancy": statuses.count("Discrepancy"),
+        "Expected Total": summary["Expected Total"],
+        "Extracted Total": summary["Extracted Total"],
+        "Difference": summary["Difference"],
+        "Results File": results_file,
+        "Seconds": round(time.perf_counter() - started, 3),
+        "Error": "",
+    }
+
+def load_supplier_map(path):
+    """Load a CSV with 'Statement' and 'Supplier' columns mapping statement files to suppliers.
+
+    Statements can be given by path, file name or file name without extension.
+    """
+    df_map = pd.read_csv(path, dtype=str)
+    if 'Statement' not in df_map.columns or 'Supplier' not in df_map.columns:
+        raise ValueError("Supplier map CSV must contain 'Statement' and 'Supplier' columns.")
+    return {str(statement).strip(): supplier for statement, supplier in zip(df_map['Statement'], df_map['Supplier'])}
+
+def _statement_supplier(statement_file, supplier_map):
+    """The supplier named for a statement in the map, or else its file name without extension."""
+    name = os.path.basename(statement_file)
+    stem = os.path.splitext(name)[0]
+    for key in (statement_file, name, stem):
+        if key in supplier_map:
+            return supplier_map[key]
+    return stem
+
+def run_batch(statement_files, extracted_files, workers=None, results_folder=RESULTS_FOLDER, supplier_map=None):
+    """Reconcile many supplier statements in parallel against one invoice index.
+
+    Each statement's supplier comes from supplier_map, or else its file name,
+    e.g. acme.csv -> 'acme'. A statement whose supplier isn't in the index is
+    reconciled against the invoices with no supplier (from older extraction
+    runs), noted in the summary's Warning column, or reported as an error
+    when there are none.
+    Returns the path of the combined summary CSV.
+    """
+    supplier_map = supplier_map or {}
+    started = time.perf_counter()
+    batch_dir = get_next_filename(os.path.join(results_folder, "batch"))
+    os.makedirs(batch_dir)
+
+    index_path = os.path.join(batch_dir, ".invoice_index.jsonl")
+    offsets = build_invoice_index(extracted_files, index_path)
+    print(f"Indexed {len(offsets)} suppliers from {len(extracted_files)} extracted file(s).")
+
+    workers = min(workers or os.cpu_count() or 1, len(statement_files))
+    summary_rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index_path, offsets)) as pool:
+            tasks = []
+            results_files = set()
+            for statement_file in statement_files:
+                stem = os.path.splitext(os.path.basename(statement_file))[0]
+                supplier = normalise_supplier(_statement_supplier(statement_file, supplier_map))
+                row = {"Supplier": _statement_supplier(statement_file, supplier_map), "Statement": statement_file, "Warning": ""}
+                if supplier not in offsets:
+                    if "" not in offsets:
+                        # Reconciling against nothing would report every line as Missing
+                        tasks.append((row, None, f"Supplier '{supplier}' not found in the invoice index"))
+                        continue
+                    row["Warning"] = f"Supplier '{supplier}' not found in the invoice index; reconciled against invoices with no supplier"
+                    supplier = ""
+                # Statements from different folders can share a file name
+                results_file = os.path.join(batch_dir, f"{stem}_reconciliation_results.csv")
+                counter = 1
+                while results_file in results_files:
+                    results_file = os.path.join(batch_dir, f"{stem}_reconciliation_results_{counter}.csv")
+                    counter += 1
+                results_files.add(results_file)
+                tasks.append((row, pool.submit(_reconcile_statement, statement_file, supplier, results_file), None))
+
+            for row, future, error in tasks:
+                try:
+                    if error:
+                        raise ValueError(error)
+                    row.update(future.result())
+                except Exception as e:
+                    print(f"Error reconciling {row['Statement']}: {e}")
+                    row["Error"] = str(e)
+                if row["Warning"]:
+                    print(f"Warning for {row['Statement']}: {row['Warning']}")
+                summary_rows.append(row)
+    finally:
+        os.remove(index_path)
+
+    summary_file = os.path.join(batch_dir, "batch_summary.csv")
+    pd.DataFrame(summary_rows).to_csv(summary_file, index=False, encoding='utf-8-sig')
+
+    elapsed = time.perf_counter() - started
+    slowest = max((row.get("Seconds", 0.0) for row in summary_rows), default=0.0)
+    print(f"\nReconciled {len(statement_files)} statements with {workers} workers in {elapsed:.2f}s (slowest statement {slowest:.2f}s).")
+    print(f"Batch summary saved to {summary_file}")
+    return summary_file
+
+# --- Out-of-core Reconciliation ---
+# Both inputs are streamed in chunks and spilled to disk, partitioned by a
+# stable hash of the Invoice ID, so every row for an ID lands in the same
+# partition. Partitions are reconciled one at a time and their results merged
+# back into the order the in-memory engine produces.
+
+STATUS_ORDER = {"Missing": 0, "Extra": 1, "Discrepancy": 2, "Matched": 3}
+SPILL_OVERHEAD = 10 # Rough in-memory bytes per byte of input once rows become Python objects
+MAX_PARTITIONS = 512 # Keeps the number of open spill files well under OS limits
+
+def _partition_count(input_bytes, memory_mb):
+    """Partitions needed for each one to fit in memory_mb, capped at MAX_PARTITIONS.
+
+    Returns (partitions, estimated MB per partition); the estimate exceeds
+    memory_mb when the cap applies.
+    """
+    estimated_bytes = input_bytes * SPILL_OVERHEAD
+    partitions = max(1, min(MAX_PARTITIONS, math.ceil(estimated_bytes / (memory_mb * 1024 * 1024))))
+    return partitions, estimated_bytes / partitions / (1024 * 1024)
+
+def _read_chunks(path, id_col, total_col, chunk_rows):
+    """Yield a list of (invoice_id, total) pairs for each chunk of a CSV."""
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype={id_col: str, total_col: str}):
+        if id_col not in chunk.columns or total_col not in chunk.columns:
+            raise ValueError(f"{path} must contain '{id_col}' and '{total_col}' columns.")
+        ids = clean_ids(chunk[id_col])
+        totals = chunk[total_col].apply(parse_amount)
+        yield list(zip(ids, totals))
+
+def _spill(chunks, spill_dir, side, partitions):
+    """Write rows to one spill file per partition and return the exact sum of their totals.
+
+    Each row keeps its position in the input so the original order can be restored.
+    """
+    spill_files = [open(os.path.join(spill_dir, f"{side}_{p}.jsonl"), 'w', encoding='utf-8') for p in range(partitions)]
+    total = Fraction(0)
+    seq = 0
+    try:
+        for rows in chunks:
+            for invoice_id, amount in rows:
+                partition = zlib.crc32(invoice_id.encode('utf-8')) % partitions
+                spill_files[partition].write(json.dumps([invoice_id, amount, seq]) + "\n")
+                seq += 1
+            # Summing exactly means chunking can't change the rounded total
+            total += sum(map(Fraction, (amount for _, amount in rows)), Fraction(0))
+    finally:
+        for f in spill_files:
+            f.close()
+    return float(total)
+
+def _read_spill(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def _reconcile_partition(spill_dir, partition):
+    """Reconcile one partition, returning result records sorted into output order."""
+    extracted_first = {}
+    extracted_last = {}
+    for invoice_id, amount, seq in _read_spill(os.path.join(spill_dir, f"extracted_{partition}.jsonl")):
+        if invoice_id != "ERROR" and invoice_id != "None":
+            extracted_first.setdefault(invoice_id, (amount, seq))
+            extracted_last[invoice_id] = amount
+
+    statement_first = {}
+    statement_last = {}
+    for invoice_id, amount, seq in _read_spill(os.path.join(spill_dir, f"statement_{partition}.jsonl")):
+        if invoice_id != "None":
+            statement_first.setdefault(invoice_id, (amount, seq))
+            statement_last[invoice_id] = amount
+
+    # Records are (rank, seq, status, invoice_id, expected_total, extracted_total)
+    records = []
+    for invoice_id, (amount, seq) in statement_first.items():
+        if invoice_id not in extracted_last:
+            records.append((STATUS_ORDER["Missing"], seq, "Missing", invoice_id, amount, 0.0))
+        else:
+            expected_total = statement_last[invoice_id]
+            extracted_total = extracted_last[invoice_id]
+            status = "Discrepancy" if abs(expected_total - extracted_total) > 0.01 else "Matched"
+            records.append((STATUS_ORDER[status], seq, status, invoice_id, expected_total, extracted_total))
+    for invoice_id, (amount, seq) in extracted_first.items():
+        if invoice_id not in statement_last:
+            records.append((STATUS_ORDER["Extra"], seq, "Extra", invoice_id, 0.0, amount))
+
+    records.sort(key=lambda record: (record[0], record[1]))
+    return records
+
+def _merge_results(run_files):
+    """Merge sorted partition results back into a single ordered stream."""
+    runs = [_read_spill(path) for path in run_files]
+    for _, _, status, invoice_id, expected_total, extracted_total in heapq.merge(*runs, key=lambda record: (record[0], record[1])):
+        yield _result_row(status, invoice_id, expected_total, extracted_total)
+
+def run_out_of_core(extracted_files, statement_file, results_file, memory_mb=256, chunk_rows=50_000, spill_dir=None):
+    """Reconcile inputs larger than memory, producing the same CSV as the in-memory engine.
+
+    Memory use is governed by memory_mb (which sets the number of partitions)
+    and chunk_rows, not by the size of the inputs.
+    """
+    input_bytes = sum(os.path.getsize(path) for path in [*extracted_files, statement_file])
+    partitions, partition_mb = _partition_count(input_bytes, memory_mb)
+    print(f"Reconciling {input_bytes / (1024 * 1024):.1f} MB out of core in {partitions} partition(s).")
+    if partition_mb > memory_mb:
+        print(f"Warning: the inputs need more than {MAX_PARTITIONS} partitions to stay within {memory_mb} MB; "
+              f"each partition will use about {partition_mb:.0f} MB. Raise --memory-mb to match.")
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as work_dir:
+        extracted_chunks = (rows for path in extracted_files for rows in _read_chunks(path, 'Invoice ID', 'Total Amount', chunk_rows))
+        extracted_sum = _spill(extracted_chunks, work_dir, "extracted", partitions)
+        statement_sum = _spill(_read_chunks(statement_file, EXPECTED_ID_COL, EXPECTED_TOTAL_COL, chunk_rows), work_dir, "statement", partitions)
+
+        run_files = []
+        for partition in range(partitions):
+            run_file = os.path.join(work_dir, f"results_{partition}.jsonl")
+            with open(run_file, 'w', encoding='utf-8') as f:
+                for record in _reconcile_partition(work_dir, partition):
+                    f.write(json.dumps(record) + "\n")
+            run_files.append(run_file)
+
+        # Write the merged results a chunk at a time, in the same CSV format as save_results
+        with open(results_file, 'w', encoding='utf-8-sig', newline='') as out:
+            header = True
+            batch = []
+            for row in _merge_results(run_files):
+                batch.append(row)
+                if len(batch) >= chunk_rows:
+                    pd.DataFrame(batch).to_csv(out, header=header, index=False)
+                    header = False
+                    batch = []
+            batch.append(_summary_row(statement_sum, extracted_sum))
+            pd.DataFrame(batch).to_csv(out, header=header, index=False)
+
+    return results_file
+
+def check_out_of_core():
+    """Check that the out-of-core engine writes exactly what the in-memory engine does.
+
+    Runs both on a small sample with repeated IDs, ERROR, None and blank IDs
+    and mismatched totals, across several partition counts and chunk sizes.
+    Returns True if every run matches.
+    """
+    extracted = (
+        "File Path,Invoice ID,Supplier,Total Amount\n"
+        "a.pdf,1001,Acme,£100.00\n"
+        "b.pdf,1002,Acme,\"£1,349.40\"\n"
+        "c.pdf,ERROR,ERROR,ERROR\n"
+        "d.pdf,None,,0\n"
+        "e.pdf,,,12.50\n"
+        "f.pdf,1001,Acme,£101.00\n"
+        "g.pdf,2001,Acme,0.10\n"
+        "h.pdf, 1003 ,Acme,£0.20\n"
+        "i.pdf,1004,Acme,£55.55\n"
+    )
+    statement = (
+        f"{EXPECTED_ID_COL},{EXPECTED_TOTAL_COL}\n"
+        "1001,£100.00\n"
+        "1002,\"£1,349.40\"\n"
+        "1003,£0.30\n"
+        ",£7.00\n"
+        "None,£1.00\n"
+        "3001,£42.00\n"
+        "1003,£0.20\n"
+        "1001,£99.00\n"
+    )
+    ok = True
+    with tempfile.TemporaryDirectory() as work_dir:
+        extracted_file = os.path.join(work_dir, "extracted_invoices.csv")
+        statement_file = os.path.join(work_dir, "supplier_statement.csv")
+        with open(extracted_file, "w", encoding="utf-8-sig") as f:
+            f.write(extracted)
+        with open(statement_file, "w", encoding="utf-8-sig") as f:
+            f.write(statement)
+
+        df_extracted = load_extracted(extracted_file)
+        df_statement = load_supplier_statement(statement_file)
+        expected_file = os.path.join(work_dir, "in_memory.csv")
+        save_results(reconcile(
+            list(zip(df_extracted['Invoice ID'], df_extracted['Total Amount'])),
+            list(zip(df_statement[EXPECTED_ID_COL], df_statement[EXPECTED_TOTAL_COL])),
+            verbose=False,
+        ), expected_file)
+        with open(expected_file, "rb") as f:
+            expected_bytes = f.read()
+
+        # A tiny memory cap forces several partitions even for this sample
+        for memory_mb in (256, 0.001, 0.0001):
+            for chunk_rows in (1, 3, 50_000):
+                results_file = os.path.join(work_dir, "out_of_core.csv")
+                run_out_of_core([extracted_file], statement_file, results_file,
+                                memory_mb=memory_mb, chunk_rows=chunk_rows, spill_dir=work_dir)
+                with open(results_file, "rb") as f:
+                    if f.read() != expected_bytes:
+                        print(f"Mismatch with memory_mb={memory_mb}, chunk_rows={chunk_rows}")
+                        ok = False
+    print("Out-of-core results match the in-memory engine." if ok else "Out-of-core results differ from the in-memory engine.")
+    return ok
+
+def reconcile_history(statement_file, start_date=None, end_date=None):
+    """Reconcile a statement against registry invoices from a date range instead of one extraction run."""
+    registry = invoice_registry.connect()
+    try:
+        extracted_rows = [(row["invoice_id"], row["total_amount"] or 0.0) for row in invoice_registry.history(registry, start_date, end_date)]
+    finally:
+        registry.close()
+    print(f"Loaded {len(extracted_rows)} registry invoices dated {start_date or 'any'} to {end_date or 'any'}.")
+
+    df_statement = load_supplier_statement(statement_file)
+    statement_rows = list(zip(df_statement[EXPECTED_ID_COL], df_statement[EXPECTED_TOTAL_COL]))
+    reconciliation_results = reconcile(extracted_rows, statement_rows)
+
+    results_file = get_next_filename(os.path.join(RESULTS_FOLDER, "reconciliation_results.csv"))
+    save_results(reconciliation_results, results_file)
+    export_results.mark_latest(results_file)
+    print(f"\nReconciliation results saved to {results_file}")
+    return results_file
+
+def _expand_statements(paths):
+    """Expand directories into the statement CSVs they contain."""
+    statement_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            statement_files.extend(sorted(glob.glob(os.path.join(path, "*.csv"))))
+        else:
+            statement_files.append(path)
+    return statement_files
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile extracted invoices against supplier statements.")
+    parser.add_argument("--batch", nargs="+", metavar="STATEMENT",
+                        help="Reconcile several statement CSVs (or directories of them) in parallel.")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Stream and partition the inputs on disk instead of loading them into memory.")
+    parser.add_argument("--extracted", default=None,
+                        help="Glob of extracted invoice CSVs for batch or out-of-core mode (default: the most recent one).")
+    parser.add_argument("--statement", default=STATEMENT_FILE, help="Supplier statement CSV.")
+    parser.add_argument("--since", default=None,
+                        help="Reconcile against registry invoices dated on or after this date (YYYY-MM-DD).")
+    parser.add_argument("--until", default=None,
+                        help="Reconcile against registry invoices dated on or before this date (YYYY-MM-DD).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for batch mode.")
+    parser.add_argument("--supplier-map", default=None,
+                        help="CSV with 'Statement' and 'Supplier' columns naming each statement's supplier in batch mode.")
+    parser.add_argument("--memory-mb", type=int, default=256, help="Memory cap for out-of-core mode.")
+    parser.add_argument("--chunk-rows", type=int, default=50_000, help="Rows read per chunk in out-of-core mode.")
+    parser.add_argument("--spill-dir", default=None, help="Directory for out-of-core spill files (default: system temp).")
+    parser.add_argument("--check-out-of-core", action="store_true",
+                        help="Check that out-of-core mode matches the in-memory engine on sample data, then exit.")
+    args = parser.parse_args(argv)
+
+    if args.check_out_of_core:
+        sys.exit(0 if check_out_of_core() else 1)
+
+    if args.extracted:
+        extracted_files = sorted(glob.glob(args.extracted), key=os.path.getctime)
+    else:
+        latest = get_most_recent_file(os.path.join(EXTRACTED_FOLDER, "extracted_invoices*.csv"))
+        extracted_files = [latest] if latest else []
+
+    if args.batch:
+        statement_files = _expand_statements(args.batch)
+        if not extracted_files or not statement_files:
+            print("Error: Batch mode needs at least one extracted invoices file and one statement.")
+            sys.exit(1)
+        supplier_map = load_supplier_map(args.supplier_map) if args.supplier_map else None
+        run_batch(statement_files, extracted_files, workers=args.workers, supplier_map=supplier_map)
+        return
+
+    if args.out_of_core:
+        if not extracted_files or not os.path.exists(args.statement):
+            print("Error: Out-of-core mode needs at least one extracted invoices file and a statement.")
+            sys.exit(1)
+        results_file = get_next_filename(os.path.join(RESULTS_FOLDER, "reconciliation_results.csv"))
+        run_out_of_core(extracted_files, args.statement, results_file,
+                        memory_mb=args.memory_mb, chunk_rows=args.chunk_rows, spill_dir=args.spill_dir)
+        export_results.mark_latest(results_file)
+        print(f"\nReconciliation results saved to {results_file}")
+        return
+
+    if args.since or args.until:
+        reconcile_history(args.statement, args.since, args.until)
+        return
+
+    # --- Define File Paths ---
+    extracted_data_file = get_most_recent_file(os.path.join(EXTRACTED_FOLDER, "extracted_invoices*.csv"))
+    statement_file = args.statement
+
+    # --- Load Data ---
+    if not extracted_data_file:
+        print("Error: No extracted invoices file found.")
+        print("Please run extract_invoices.py first to generate this file.")
+        exit()
+
+    print(f"Loading extracted data from: {extracted_data_file}")
+
+    try:
+        df_extracted = load_extracted(extracted_data_file)
+        print(f"Successfully loaded {len(df_extracted)} extracted records.")
+    except Exception as e:
+        print(f"Error loading extracted data from {extracted_data_file}: {e}")
+        exit()
+
+    print(f"Loading supplier statement from: {statement_file}")
+    if not os.path.exists(statement_file):
+        print(f"Error: Supplier statement file not found at {statement_file}.")
+        print("Please create the supplier_statement.csv file as described in the previous step.")
+        exit()
+
+    try:
+        df_statement = load_supplier_statement(statement_file)
+        print(f"Successfully loaded {len(df_statement)} statement records.")
+    except Exception as e:
+        print(f"Error loading supplier statement from {statement_file}: {e}")
+        exit()
+
+    # --- Reconciliation Logic ---
+    print("\n--- Performing Reconciliation ---")
+
+    extracted_rows = list(zip(df_extracted['Invoice ID'], df_extracted['Total Amount']))
+    statement_rows = list(zip(df_statement[EXPECTED_ID_COL], df_statement[EXPECTED_TOTAL_COL]))
+    reconciliation_results = reconcile(extracted_rows, statement_rows)
+
+    # Save reconciliation results to CSV
+    results_file = get_next_filename(os.path.join(RESULTS_FOLDER, "reconciliation_results.csv"))
+    save_results(reconciliation_results, results_file)
+    export_results.mark_latest(results_file)
+    print(f"\nReconciliation results saved to {results_file}")
+
+    print("\nReconciliation complete.")
+
+if __name__ == '__main__':
+    main()
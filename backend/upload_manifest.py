@@ -0,0 +1,256 @@
+"""Manifest of uploaded invoice files and their extraction status.
+
+Every file in the upload folder has one entry holding its size, content hash,
+upload time, extraction status (pending, extracted, failed or rejected by
+pre-flight checks), pre-flight metadata, the Invoice ID it produced, its last
+error and its extracted CSV row. Uploads, deletes and
+the extractor all update the manifest inside SQLite transactions, and each
+process keeps an in-memory copy that is only reloaded when another process
+has committed a change.
+"""
+import os
+import csv
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB = "upload_manifest.db"
+DEFAULT_QUARANTINE_FOLDER = "invoice_quarantine"
+
+# Columns of the extracted invoices CSV, in the order the extractor writes them
+EXTRACTED_COLUMNS = [
+    "File Path", "Invoice ID", "Supplier", "Invoice Date",
+    "Net Total", "Tax Total", "Total Amount", "Descriptions",
+]
+
+PENDING = "pending"
+EXTRACTED = "extracted"
+FAILED = "failed"
+REJECTED = "rejected"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_hash TEXT,
+    uploaded_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    invoice_id TEXT,
+    last_error TEXT,
+    extracted_row TEXT,
+    metadata TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_status ON uploads (status, uploaded_at);
+CREATE INDEX IF NOT EXISTS idx_uploads_uploaded_at ON uploads (uploaded_at);
+"""
+
+class UploadManifest:
+    """Upload manifest backed by SQLite with a per-process in-memory cache."""
+
+    def __init__(self, path=None, quarantine_folder=None):
+        self.path = path or os.getenv("INVOICING_MANIFEST_DB", DEFAULT_DB)
+        self.quarantine_folder = quarantine_folder or os.getenv("INVOICING_QUARANTINE_FOLDER", DEFAULT_QUARANTINE_FOLDER)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._entries = None
+        self._data_version = None
+
+    def _connection(self):
+        # SQLite connections must not be shared across a fork, so reconnect in each worker
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            # Manifests created before pre-flight metadata was recorded
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(uploads)")}
+            if "metadata" not in columns:
+                self._conn.execute("ALTER TABLE uploads ADD COLUMN metadata TEXT")
+            self._pid = os.getpid()
+            self._entries = None
+        return self._conn
+
+    def _load(self):
+        """Return the cached entries, reloading them if any connection has committed since."""
+        conn = self._connection()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._entries is None or data_version != self._data_version:
+            rows = conn.execute("SELECT * FROM uploads ORDER BY uploaded_at, filename").fetchall()
+            self._entries = {}
+            for row in rows:
+                entry = dict(row)
+                entry["metadata"] = json.loads(entry["metadata"]) if entry["metadata"] else None
+                self._entries[row["filename"]] = entry
+            self._data_version = data_version
+        return self._entries
+
+    def _write(self, statement, params=()):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                cursor = conn.execute(statement, params)
+            # data_version only changes for other connections, so drop our own cache
+            self._entries = None
+            return cursor.rowcount
+
+    def entries(self):
+        """All entries in upload order, without the stored extraction rows."""
+        with self._lock:
+            return [
+                {key: value for key, value in entry.items() if key != "extracted_row"}
+                for entry in self._load().values()
+            ]
+
+    def get(self, filename):
+        with self._lock:
+            return self._load().get(filename)
+
+    def pending(self):
+        """File names still waiting for extraction, oldest first.
+
+        Files whose last extraction failed are retried on every run; only files
+        rejected by the pre-flight checks are left out.
+        """
+        with self._lock:
+            return [name for name, entry in self._load().items() if entry["status"] in (PENDING, FAILED)]
+
+    def extracted_rows(self):
+        """Extracted CSV rows for every file that has been processed, in upload order."""
+        with self._lock:
+            return [
+                json.loads(entry["extracted_row"])
+                for entry in self._load().values()
+                if entry["extracted_row"] is not None
+            ]
+
+    def write_extracted_csv(self, path):
+        """Write every stored extracted row to a CSV, with a header even when there are none."""
+        rows = self.extracted_rows()
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=EXTRACTED_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def record_upload(self, filename, size, content_hash=None, uploaded_at=None, metadata=None, status=PENDING, error=None):
+        """Add or replace an uploaded file, queueing it for extraction unless a status is given.
+
+        Replacing a rejected entry deletes the file it had quarantined.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                old_row = conn.execute("SELECT status, metadata FROM uploads WHERE filename = ?", (filename,)).fetchone()
+                old_quarantined = self._quarantined_path(old_row) if old_row else None
+                new_quarantined = (metadata or {}).get("quarantined_as")
+                if (old_quarantined and os.path.exists(old_quarantined)
+                        and os.path.basename(old_quarantined) != new_quarantined):
+                    os.remove(old_quarantined)
+                conn.execute(
+                    """
+                    INSERT INTO uploads (filename, size, content_hash, uploaded_at, status, invoice_id, last_error, extracted_row, metadata, updated_at)
+                    VALUES (?, ?, ?, ?, ?, NULL, ?, NULL, ?, ?)
+                    ON CONFLICT (filename) DO UPDATE SET
+                        size = excluded.size,
+                        content_hash = excluded.content_hash,
+                        uploaded_at = excluded.uploaded_at,
+                        status = excluded.status,
+                        invoice_id = NULL,
+                        last_error = excluded.last_error,
+                        extracted_row = NULL,
+                        metadata = excluded.metadata,
+                        updated_at = excluded.updated_at
+                    """,
+                    (filename, size, content_hash, uploaded_at or now, status, error,
+                     json.dumps(metadata) if metadata else None, now),
+                )
+            self._entries = None
+
+    def mark_extracted(self, filename, invoice_id, extracted_row):
+        self._write(
+            "UPDATE uploads SET status = ?, invoice_id = ?, last_error = NULL, extracted_row = ?, updated_at = ? WHERE filename = ?",
+            (EXTRACTED, invoice_id, json.dumps(extracted_row, default=str), time.time(), filename),
+        )
+
+    def mark_failed(self, filename, error, extracted_row=None):
+        self._write(
+            "UPDATE uploads SET status = ?, invoice_id = NULL, last_error = ?, extracted_row = ?, updated_at = ? WHERE filename = ?",
+            (FAILED, str(error), json.dumps(extracted_row, default=str) if extracted_row else None, time.time(), filename),
+        )
+
+    def set_metadata(self, filename, metadata):
+        self._write(
+            "UPDATE uploads SET metadata = ?, updated_at = ? WHERE filename = ?",
+            (json.dumps(metadata), time.time(), filename),
+        )
+
+    def mark_rejected(self, filename, reason, metadata=None):
+        self._write(
+            "UPDATE uploads SET status = ?, last_error = ?, metadata = ?, updated_at = ? WHERE filename = ?",
+            (REJECTED, reason, json.dumps(metadata) if metadata else None, time.time(), filename),
+        )
+
+    def _quarantined_path(self, row):
+        """Where a rejected upload was quarantined, or None if it wasn't moved."""
+        metadata = json.loads(row["metadata"]) if row["metadata"] else {}
+        if row["status"] == REJECTED and metadata.get("quarantined_as"):
+            return os.path.join(self.quarantine_folder, metadata["quarantined_as"])
+        return None
+
+    def remove(self, filename, file_path=None):
+        """Remove an entry and, in the same transaction, its file (or its quarantined copy).
+
+        Returns False, without touching any file, if it wasn't listed.
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                row = conn.execute("SELECT status, metadata FROM uploads WHERE filename = ?", (filename,)).fetchone()
+                if row is None:
+                    # Leave unlisted files to the caller
+                    return False
+                conn.execute("DELETE FROM uploads WHERE filename = ?", (filename,))
+                # If a file can't be deleted the entry is rolled back with it
+                for path in (file_path, self._quarantined_path(row)):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+            self._entries = None
+            return True
+
+    def clear(self):
+        """Remove every entry along with any quarantined files."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                rows = conn.execute("SELECT status, metadata FROM uploads WHERE status = ?", (REJECTED,)).fetchall()
+                conn.execute("DELETE FROM uploads")
+                for row in rows:
+                    path = self._quarantined_path(row)
+                    if path and os.path.exists(path):
+                        os.remove(path)
+            self._entries = None
+
+    def sync(self, upload_folder, extensions):
+        """Bring the entries in line with the upload folder.
+
+        Files added outside an upload (or before the manifest existed) are
+        queued for extraction and entries whose file has gone are dropped.
+        Quarantined files live elsewhere, so their entries are kept.
+        """
+        known = {
+            entry["filename"] for entry in self.entries()
+            if not (entry["status"] == REJECTED and (entry["metadata"] or {}).get("quarantined_as"))
+        }
+        present = set()
+        with os.scandir(upload_folder) as files:
+            for entry in files:
+                if entry.is_file() and entry.name.rsplit('.', 1)[-1].lower() in extensions:
+                    present.add(entry.name)
+                    if entry.name not in known:
+                        stat = entry.stat()
+                        self.record_upload(entry.name, stat.st_size, uploaded_at=stat.st_ctime)
+        for filename in known - present:
+            self.remove(filename)